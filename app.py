@@ -1,12 +1,33 @@
 # app.py
 import streamlit as st
-from main import run_security_scan, SecurityState
+import pandas as pd
+from main import run_security_workflow, generate_audit_reports, SecurityState, audit_writer
+from pathlib import Path
+from typing import Tuple
 import os
 
 # Ensure logs directory exists
 if not os.path.exists("logs"):
     os.makedirs("logs")
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_scan(instruction: str, scope: Tuple[str, ...]) -> SecurityState:
+    """Run the workflow once per (instruction, scope) and reuse the result for a few minutes."""
+    return run_security_workflow(instruction, list(scope))
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _read_report(path: str, mtime: int) -> bytes:
+    """Read a report file; mtime is part of the cache key so rewrites invalidate it."""
+    return Path(path).read_bytes()
+
+def _report_download(label: str, path: str, file_name: str, mime: str):
+    """Offer a report for download, preferring a gzipped copy written for this version."""
+    gz_path = path + ".gz"
+    if os.path.exists(gz_path) and os.stat(gz_path).st_mtime_ns >= os.stat(path).st_mtime_ns:
+        path, file_name, mime = gz_path, file_name + ".gz", "application/gzip"
+    data = _read_report(path, os.stat(path).st_mtime_ns)
+    st.download_button(label, data, file_name, mime=mime)
+
 # Streamlit UI
 st.title("Agentic Cybersecurity Workflow")
 st.write("Enter a security instruction and define the scope to run scans. Ensure nmap and gobuster are installed.")
@@ -18,24 +39,25 @@ run_button = st.button("Run Scan")
 
 # Process and display results
 if run_button and instruction and scope_input:
-    scope = [s.strip() for s in scope_input.split(",")]
+    scope = tuple(s.strip() for s in scope_input.split(","))
     with st.spinner("Running security scans..."):
-        result = run_security_scan(instruction, scope)
+        result = _cached_scan(instruction, scope)
+    # Don't keep failed runs (e.g. a scanner not installed yet) for the next click
+    if any(task.status == "failed" for task in result.executed_tasks):
+        _cached_scan.clear(instruction, scope)
+    # The report files are shared by every session, so always rewrite them
+    # for this result before offering them for download
+    reports_queued = generate_audit_reports(result)
     
     st.success("Scan completed!")
     
-    # Display executed tasks
+    # Display executed tasks as one table (a single message to the browser)
     st.subheader("Executed Tasks")
-    for task in result.executed_tasks:
-        st.write(f"**Tool:** {task['tool']}")
-        st.write(f"**Command:** `{task['command']}`")
-        st.write(f"**Status:** {task['status']}")
-        st.write(f"**Timestamp:** {task['timestamp']}")
-        if task.get("output"):
-            st.code(task["output"][:500] + "..." if len(task["output"]) > 500 else task["output"])
-        if task.get("error"):
-            st.error(f"Error: {task['error']}")
-        st.write("---")
+    df = pd.DataFrame(result.executed_tasks).reindex(
+        columns=["tool", "command", "status", "timestamp", "output", "error"]
+    )
+    df["output"] = df["output"].astype("string").str.slice(0, 500)
+    st.dataframe(df, hide_index=True)
     
     # Display scope violations
     if result.scope_violations:
@@ -43,12 +65,15 @@ if run_button and instruction and scope_input:
         for violation in result.scope_violations:
             st.write(f"- {violation}")
     
-    # Provide download links for reports
-    json_path = "logs/audit_report.json"
-    md_path = "logs/audit_report.md"
-    if os.path.exists(json_path):
-        with open(json_path, "r") as f:
-            st.download_button("Download JSON Report", f.read(), "audit_report.json")
-    if os.path.exists(md_path):
-        with open(md_path, "r") as f:
-            st.download_button("Download Markdown Report", f.read(), "audit_report.md")
\ No newline at end of file
+    # Provide download links for reports once the background writer has caught up;
+    # if it dropped a write, the files on disk belong to an earlier scan
+    if not reports_queued:
+        st.error("The audit reports for this scan could not be written. Please run the scan again.")
+    else:
+        audit_writer.flush()
+        json_path = "logs/audit_report.json"
+        md_path = "logs/audit_report.md"
+        if os.path.exists(json_path):
+            _report_download("Download JSON Report", json_path, "audit_report.json", "application/json")
+        if os.path.exists(md_path):
+            _report_download("Download Markdown Report", md_path, "audit_report.md", "text/markdown")
\ No newline at end of file
@@ -1,194 +1,587 @@
 # main.py
+import asyncio
+import atexit
 import datetime
+import gzip
+import ipaddress
 import os
-import subprocess
-from typing import List, Dict, Optional
+import queue
+import re
+import shlex
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from typing import List, Dict, Deque, Optional, Tuple, Union
+from xml.etree import ElementTree
+import jinja2
 from langgraph.graph import StateGraph, END
-from pydantic import BaseModel
 import logging
+import logging.handlers
 import json
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, filename='security.log')
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+# Setup logging: callers only enqueue records, a listener thread does the file I/O
+def _setup_logging():
+    """Install the queue-backed file logging once, like basicConfig, even if main is re-imported."""
+    root = logging.getLogger()
+    if any(isinstance(h, logging.handlers.QueueHandler) for h in root.handlers):
+        return
+    file_handler = logging.FileHandler('security.log')
+    file_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+
+_setup_logging()
 logger = logging.getLogger(__name__)
 
 # Ensure logs directory exists
 LOGS_DIR = "logs"
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# 1 MiB file buffer, so even large reports reach disk in a few write() calls
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Characters of tool output kept on a TaskResult; longer output is spilled to a file
+# in a per-run directory under TASK_OUTPUT_DIR, of which only the newest few are kept
+OUTPUT_CAPTURE_LIMIT = 4096
+TASK_OUTPUT_DIR = os.path.join(LOGS_DIR, "task_output")
+TASK_OUTPUT_RUNS_KEPT = 5
+
+# Reports larger than this also get a gzipped copy for download
+GZIP_THRESHOLD = 1 << 20
+
 # Define state model
-class SecurityState(BaseModel):
-    task_list: List[Dict] = []
-    executed_tasks: List[Dict] = []
-    scope: List[str] = []
-    scope_violations: List[str] = []
-    current_task: Optional[Dict] = None
+@dataclass(slots=True)
+class TaskResult:
+    tool: str
+    command: str
+    status: str
+    timestamp: str
+    target: str = ""
+    output: str = ""
+    output_truncated: bool = False
+    output_full_path: Optional[str] = None
+    error: str = ""
+    error_truncated: bool = False
+    error_full_path: Optional[str] = None
+    open_ports: Dict[str, List[int]] = field(default_factory=dict)
+
+@dataclass(slots=True)
+class SecurityState:
+    task_list: Deque[Dict] = field(default_factory=deque)
+    executed_tasks: List[TaskResult] = field(default_factory=list)
+    scope: List[str] = field(default_factory=list)
+    scope_trie: Dict = field(default_factory=dict)
+    scope_violations: List[str] = field(default_factory=list)
+    last_results: List[TaskResult] = field(default_factory=list)
+    next_task_id: int = 0
+    output_dir: str = ""
     retries: int = 0
     max_retries: int = 3
 
 # Scope enforcement
-def is_within_scope(target: str, scope: List[str]) -> bool:
-    """Check if target is within defined scope."""
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+def _domain_labels(name: str) -> List[str]:
+    """Split a host name into lower-cased labels, top-level label first."""
+    return name.strip().lower().rstrip(".").split(".")[::-1]
+
+def _parse_network(name: str) -> Optional[IPNetwork]:
+    """Parse an address or CIDR range such as 192.168.1.0/24, or return None for host names."""
+    try:
+        return ipaddress.ip_network(name.strip(), strict=False)
+    except ValueError:
+        return None
+
+def build_scope_trie(scope: List[str]) -> Dict:
+    """Build a reversed-label trie of the scope, e.g. {"com": {"example": {"_end": True}}}.
+    
+    Addresses and CIDR ranges are kept under the "_networks" key instead.
+    """
+    trie = {}
     for scope_item in scope:
-        if scope_item in target or target in scope_item:
+        network = _parse_network(scope_item)
+        if network is not None:
+            trie.setdefault("_networks", []).append(network)
+            continue
+        node = trie
+        for label in _domain_labels(scope_item):
+            node = node.setdefault(label, {})
+        node["_end"] = True
+    return trie
+
+def is_within_scope(target: str, scope_trie: Dict) -> bool:
+    """Check if target is a scope entry, a subdomain of one, or inside a scoped network."""
+    network = _parse_network(target)
+    if network is not None:
+        return any(
+            network.version == scoped.version and network.subnet_of(scoped)
+            for scoped in scope_trie.get("_networks", [])
+        )
+    node = scope_trie
+    for label in _domain_labels(target):
+        node = node.get(label)
+        if node is None:
+            return False
+        if "_end" in node:
             return True
     return False
 
+# Output capture
+def new_output_dir() -> str:
+    """Return a fresh per-run sidecar directory, pruning runs beyond TASK_OUTPUT_RUNS_KEPT."""
+    os.makedirs(TASK_OUTPUT_DIR, exist_ok=True)
+    runs = sorted(
+        entry.name for entry in os.scandir(TASK_OUTPUT_DIR) if entry.is_dir()
+    )
+    for name in runs[:max(0, len(runs) - (TASK_OUTPUT_RUNS_KEPT - 1))]:
+        shutil.rmtree(os.path.join(TASK_OUTPUT_DIR, name), ignore_errors=True)
+    
+    # Names sort chronologically, so pruning keeps the newest runs
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    output_dir = os.path.join(TASK_OUTPUT_DIR, run_id)
+    os.makedirs(output_dir)
+    return output_dir
+
+def capture_output(data: bytes, suffix: str, output_dir: str) -> Tuple[str, bool, Optional[str]]:
+    """Decode tool output, keeping only its head and spilling the full text to a sidecar.
+    
+    Returns the kept text, whether it was truncated, and the sidecar path, which
+    is None when nothing was cut or the background writer had to drop the file.
+    """
+    text = data.decode(errors="replace")
+    if len(text) <= OUTPUT_CAPTURE_LIMIT:
+        return text, False, None
+    full_path = os.path.join(output_dir, f"task_{uuid.uuid4().hex}.{suffix}")
+    if not audit_writer.submit(("out", full_path, text)):
+        full_path = None
+    return text[:OUTPUT_CAPTURE_LIMIT], True, full_path
+
 # Task execution (real tools for Windows)
-def execute_security_tool(task: Dict, scope: List[str]) -> Dict:
+async def execute_security_tool(task: Dict, scope_trie: Dict, output_dir: str) -> TaskResult:
     """Execute security tool with scope enforcement."""
     command = task["command"]
     tool = task["tool"]
     target = task["target"]
+    targets = task.get("targets") or [target]
+    timestamp = datetime.datetime.now().isoformat(timespec="seconds")
     
-    if not is_within_scope(target, scope):
+    if not all(is_within_scope(t, scope_trie) for t in targets):
         violation_msg = f"Out-of-scope command attempted: {command}"
-        return {
-            "tool": tool,
-            "command": command,
-            "status": "failed",
-            "error": violation_msg,
-            "timestamp": str(datetime.datetime.now())
-        }
+        return TaskResult(
+            tool=tool,
+            command=command,
+            target=target,
+            status="failed",
+            error=violation_msg,
+            timestamp=timestamp
+        )
     
     try:
-        # On Windows, use shell=True for compatibility with command-line tools
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=300
+        # Exec the tool directly (no intermediate shell) and await its output
+        # so many scans can overlap on a single event loop.
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(command),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout=300)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return TaskResult(
+                tool=tool,
+                command=command,
+                target=target,
+                status="failed",
+                error="Command timed out after 300 seconds",
+                timestamp=timestamp
+            )
+        output, output_truncated, output_full_path = capture_output(stdout, "out", output_dir)
+        error, error_truncated, error_full_path = "", False, None
+        if proc.returncode != 0:
+            error, error_truncated, error_full_path = capture_output(stderr, "err", output_dir)
+        return TaskResult(
+            tool=tool,
+            command=command,
+            target=target,
+            status="success" if proc.returncode == 0 else "failed",
+            output=output,
+            output_truncated=output_truncated,
+            output_full_path=output_full_path,
+            error=error,
+            error_truncated=error_truncated,
+            error_full_path=error_full_path,
+            timestamp=timestamp
         )
-        return {
-            "tool": tool,
-            "command": command,
-            "status": "success" if result.returncode == 0 else "failed",
-            "output": result.stdout,
-            "error": result.stderr if result.returncode != 0 else None,
-            "timestamp": str(datetime.datetime.now())
-        }
-    except subprocess.TimeoutExpired:
-        return {
-            "tool": tool,
-            "command": command,
-            "status": "failed",
-            "error": "Command timed out after 300 seconds",
-            "timestamp": str(datetime.datetime.now())
-        }
     except Exception as e:
-        return {
-            "tool": tool,
-            "command": command,
-            "status": "failed",
-            "error": str(e),
-            "timestamp": str(datetime.datetime.now())
-        }
+        return TaskResult(
+            tool=tool,
+            command=command,
+            target=target,
+            status="failed",
+            error=str(e),
+            timestamp=timestamp
+        )
+
+# Background report writer
+class AsyncAuditWriter:
+    """Write report files on a daemon thread fed by a bounded queue."""
+    
+    _STOP = object()
+    
+    def __init__(self, maxsize: int = 10000, batch_size: int = 100, flush_interval: float = 1.0):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._closed = False
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._writer_loop, name="audit-writer", daemon=True)
+        # Lets a re-imported main find this writer instead of starting another one
+        self._thread.audit_writer = self
+        self._thread.start()
+    
+    def submit(self, item: Tuple[str, str, str]) -> bool:
+        """Queue a (kind, path, payload) write without blocking the caller.
+        
+        kind "gz" writes the payload gzipped and "rm" deletes the path instead.
+        """
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning(f"Audit writer queue full, dropped write to {item[1]} ({self.dropped} dropped)")
+            return False
+    
+    def flush(self):
+        """Block until every queued write has reached disk."""
+        self._queue.join()
+    
+    def flush_and_close(self):
+        """Drain pending writes and stop the writer thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join()
+    
+    def _writer_loop(self):
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self._flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                # Each report is a full rewrite, so only the newest payload per
+                # path needs to hit disk; every file is opened once per batch.
+                pending = {}
+                for item in batch:
+                    if item is self._STOP:
+                        stopping = True
+                        continue
+                    kind, path, payload = item
+                    pending.setdefault(path, []).append((kind, payload))
+                for path, payloads in pending.items():
+                    kind, payload = payloads[-1]
+                    try:
+                        self._write(kind, path, payload)
+                    except Exception as e:
+                        # Never let one bad write kill the thread; flush() would hang
+                        logger.error(f"Failed to write {path}: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _write(self, kind: str, path: str, payload: str):
+        if kind == "rm":
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return
+        if kind == "gz":
+            with gzip.open(path, "wt", encoding="utf-8") as f:
+                f.write(payload)
+        else:
+            with open(path, "w", buffering=WRITE_BUFFER_SIZE, encoding="utf-8") as f:
+                f.write(payload)
+        if kind == "out":
+            logger.info(f"Task output written: {path}")
+        else:
+            logger.info(f"Audit report written: {path}")
+
+def _get_audit_writer() -> AsyncAuditWriter:
+    """Return the process-wide writer, creating it only on the first import of main."""
+    for thread in threading.enumerate():
+        writer = getattr(thread, "audit_writer", None)
+        if writer is not None:
+            return writer
+    writer = AsyncAuditWriter()
+    atexit.register(writer.flush_and_close)
+    return writer
+
+audit_writer = _get_audit_writer()
 
 # Report generation
-def generate_audit_reports(state: SecurityState):
-    """Generate JSON and Markdown audit reports."""
-    audit_report = {
-        "timestamp": str(datetime.datetime.now()),
-        "target_scope": state.scope,
-        "executed_tasks": state.executed_tasks,
-        "scope_violations": state.scope_violations
-    }
+def _dumps_json(obj) -> str:
+    """Serialize obj as 2-space indented JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2, default=asdict)
+
+def _indent_json(obj, level: int) -> str:
+    """Serialize obj with _dumps_json, indented to sit at the given nesting level."""
+    return _dumps_json(obj).replace("\n", "\n" + "  " * level)
+
+# The Markdown template is compiled once at import; its macros render the
+# header, each task and the footer so the report can be built piecewise
+_MD_TEMPLATE = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.dirname(os.path.abspath(__file__))),
+    autoescape=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=True
+).get_template("report.md.j2").module
+
+def _submit_report(kind: str, path: str, payload: str) -> bool:
+    """Queue a report, plus a gzipped copy alongside it when it is large.
+    
+    Returns False if the writer dropped either write, in which case the files
+    on disk may still hold an earlier report.
+    """
+    accepted = audit_writer.submit((kind, path, payload))
+    if len(payload) > GZIP_THRESHOLD:
+        accepted = audit_writer.submit(("gz", path + ".gz", payload)) and accepted
+    else:
+        # Drop any copy left by an earlier, larger report so it is never served
+        accepted = audit_writer.submit(("rm", path + ".gz", "")) and accepted
+    return accepted
+
+def generate_audit_reports(state: SecurityState) -> bool:
+    """Render JSON and Markdown audit reports and queue them for writing.
+    
+    Returns whether every report write was accepted by the background writer.
+    """
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    json_parts = [
+        '{\n  "timestamp": ', _dumps_json(timestamp),
+        ',\n  "target_scope": ', _indent_json(state.scope, 1),
+        ',\n  "executed_tasks": ['
+    ]
+    md_parts = [_MD_TEMPLATE.header(timestamp, state.scope)]
+    
+    # One pass over the executed tasks emits both formats while each task is hot
+    for i, task in enumerate(state.executed_tasks):
+        json_parts.append(",\n    " if i else "\n    ")
+        json_parts.append(_indent_json(task, 2))
+        md_parts.append(_MD_TEMPLATE.task(task))
+    
+    json_parts.append("\n  ]" if state.executed_tasks else "]")
+    json_parts.append(',\n  "scope_violations": ')
+    json_parts.append(_indent_json(state.scope_violations, 1))
+    json_parts.append("\n}")
+    md_parts.append(_MD_TEMPLATE.footer(state.scope_violations))
     
     json_path = os.path.join(LOGS_DIR, "audit_report.json")
-    with open(json_path, "w") as f:
-        json.dump(audit_report, f, indent=2)
+    json_queued = _submit_report("json", json_path, "".join(json_parts))
     
     md_path = os.path.join(LOGS_DIR, "audit_report.md")
-    with open(md_path, "w") as f:
-        f.write("# Cybersecurity Audit Report\n\n")
-        f.write(f"**Generated:** {audit_report['timestamp']}\n")
-        f.write(f"**Target Scope:** {', '.join(state.scope)}\n\n")
-        
-        f.write("## Executed Tasks\n")
-        for task in state.executed_tasks:
-            f.write(f"### {task['tool']} Scan\n")
-            f.write(f"- **Command:** `{task['command']}`\n")
-            f.write(f"- **Status:** {task['status']}\n")
-            f.write(f"- **Timestamp:** {task['timestamp']}\n")
-            if task.get("output"):
-                f.write(f"- **Output:**\n```\n{task['output'][:500]}...\n```\n")
-            if task.get("error"):
-                f.write(f"- **Error:** {task['error']}\n")
-            f.write("\n")
-        
-        if state.scope_violations:
-            f.write("## Scope Violations\n")
-            for violation in state.scope_violations:
-                f.write(f"- {violation}\n")
+    md_queued = _submit_report("md", md_path, "".join(md_parts))
+    
+    if json_queued and md_queued:
+        logger.info(f"Audit reports queued: {json_path}, {md_path}")
+        return True
+    logger.error(f"Audit reports could not all be queued: {json_path}, {md_path}")
+    return False
+
+# Nmap result parsing
+def parse_nmap_xml(xml_path: str) -> Dict[str, List[int]]:
+    """Split a multi-host nmap XML report into open TCP/UDP ports per host."""
+    open_ports = {}
+    try:
+        root = ElementTree.parse(xml_path).getroot()
+    except (OSError, ElementTree.ParseError) as e:
+        logger.warning(f"Could not parse nmap report {xml_path}: {e}")
+        return open_ports
+    
+    for host in root.iter("host"):
+        # Prefer the name the target was given as, so it lines up with the scope
+        hostname = host.find("hostnames/hostname[@type='user']")
+        address = host.find("address")
+        if hostname is not None:
+            name = hostname.get("name")
+        elif address is not None:
+            name = address.get("addr")
+        else:
+            continue
+        open_ports[name] = [
+            int(port.get("portid"))
+            for port in host.iter("port")
+            if port.find("state[@state='open']") is not None
+        ]
+    return open_ports
+
+# Task creation helper
+def new_task(state: SecurityState, tool: str, command: str, target: str, **extra) -> Dict:
+    """Create a pending task with a unique, monotonically increasing id."""
+    task = {
+        "id": state.next_task_id,
+        "tool": tool,
+        "command": command,
+        "target": target,
+        "status": "pending",
+        **extra
+    }
+    state.next_task_id += 1
+    return task
+
+def new_nmap_batch_task(state: SecurityState, targets: List[str]) -> Dict:
+    """Create one nmap task covering every target via an -iL host list."""
+    # A single nmap process scans all hosts, instead of one fork+exec per target
+    with tempfile.NamedTemporaryFile("w", prefix="nmap_", suffix="_targets.txt", delete=False) as f:
+        f.write("\n".join(targets) + "\n")
+        targets_path = f.name
+    xml_fd, xml_path = tempfile.mkstemp(prefix="nmap_", suffix=".xml")
+    os.close(xml_fd)
     
-    logger.info(f"Audit reports generated: {json_path}, {md_path}")
+    command = f"nmap -p 1-1000 -oX {shlex.quote(xml_path)} -iL {shlex.quote(targets_path)}"
+    return new_task(
+        state, "nmap", command, " ".join(targets),
+        targets=list(targets), targets_path=targets_path, xml_path=xml_path
+    )
+
+def remove_task_files(task: Dict):
+    """Delete the temporary files a task was planned with, if any."""
+    for key in ("targets_path", "xml_path"):
+        path = task.get(key)
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
 # Task planning node
+# Instruction keywords, classified case-insensitively in a single pass
+_INTENT_RE = re.compile(
+    r"(?P<ports>\bports?\b)|(?P<dirs>\bdirector(?:y|ies)\b)|(?P<scan>\bscan\w*)",
+    re.IGNORECASE
+)
+
 def plan_tasks(state: SecurityState) -> SecurityState:
     """Generate initial task list from instruction."""
     instruction = state.task_list[0]["instruction"] if state.task_list else ""
+    state.task_list = deque()
+    state.output_dir = new_output_dir()
+    hits = {m.lastgroup for m in _INTENT_RE.finditer(instruction)}
+    
+    if "scan" in hits and "ports" in hits:
+        state.task_list.append(new_nmap_batch_task(state, state.scope))
+    if "dirs" in hits:
+        state.task_list.append(new_task(
+            state, "gobuster", f"gobuster dir -u http://{state.scope[0]} -w common.txt", state.scope[0]
+        ))
     
-    if "scan" in instruction.lower() and "ports" in instruction.lower():
-        state.task_list = [
-            {
-                "tool": "nmap",
-                "command": f"nmap -p 1-1000 {state.scope[0]}",
-                "target": state.scope[0],
-                "status": "pending"
-            }
-        ]
-    if "directories" in instruction.lower():
-        state.task_list.append({
-            "tool": "gobuster",
-            "command": f"gobuster dir -u http://{state.scope[0]} -w common.txt",
-            "target": state.scope[0],
-            "status": "pending"
-        })
-    
-    state.current_task = state.task_list[0]
     return state
 
 # Task execution node
-def execute_task(state: SecurityState) -> SecurityState:
-    """Execute current task and update state."""
-    if not state.current_task:
+async def execute_task(state: SecurityState) -> SecurityState:
+    """Execute all pending tasks concurrently and update state."""
+    # Tasks are queued in id order, so draining from the left keeps the batch ordered
+    batch = []
+    while state.task_list:
+        batch.append(state.task_list.popleft())
+    state.last_results = []
+    if not batch:
         return state
     
-    result = execute_security_tool(state.current_task, state.scope)
-    state.executed_tasks.append(result)
+    # The scanners are independent, I/O-bound subprocesses, so await them
+    # together instead of running them one by one, at most two per scope entry.
+    limit = asyncio.Semaphore(max(1, len(state.scope) * 2))
     
-    if "Out-of-scope" in result.get("error", ""):
-        state.scope_violations.append(result["error"])
+    async def run_bounded(task: Dict) -> TaskResult:
+        async with limit:
+            return await execute_security_tool(task, state.scope_trie, state.output_dir)
     
-    state.task_list = [t for t in state.task_list if t["status"] == "pending"]
-    state.current_task = state.task_list[0] if state.task_list else None
+    results = await asyncio.gather(*[run_bounded(task) for task in batch])
+    
+    # Record results in task id order so the state stays deterministic
+    retry_tasks = []
+    for task, result in zip(batch, results):
+        state.executed_tasks.append(result)
+        state.last_results.append(result)
+        if result.tool == "nmap" and result.status == "success":
+            result.open_ports = parse_nmap_xml(task["xml_path"])
+        
+        if "Out-of-scope" in result.error:
+            state.scope_violations.append(result.error)
+        elif result.status == "failed":
+            retry_tasks.append(task)
+    
+    if retry_tasks and state.retries < state.max_retries:
+        state.retries += 1
+        for task in retry_tasks:
+            logger.info(f"Retrying task {task['command']} (Attempt {state.retries})")
+            state.task_list.append(task)
+    else:
+        retry_tasks = []
+    
+    # Temporary files are only needed while a task can still run again
+    retry_ids = {task["id"] for task in retry_tasks}
+    for task in batch:
+        if task["id"] not in retry_ids:
+            remove_task_files(task)
     return state
 
 # Analysis and task update node
 def analyze_and_update(state: SecurityState) -> SecurityState:
     """Analyze results and update task list."""
-    last_result = state.executed_tasks[-1] if state.executed_tasks else {}
+    planned = {r.target for r in state.executed_tasks if r.tool == "gobuster"}
+    planned.update(t["target"] for t in state.task_list if t["tool"] == "gobuster")
     
-    if last_result.get("tool") == "nmap" and last_result.get("status") == "success":
-        if "80" in last_result.get("output", "") or "443" in last_result.get("output", ""):
-            state.task_list.append({
-                "tool": "gobuster",
-                "command": f"gobuster dir -u http://{state.scope[0]} -w common.txt",
-                "target": state.scope[0],
-                "status": "pending"
-            })
+    for result in state.last_results:
+        if result.tool != "nmap" or result.status != "success":
+            continue
+        for host, ports in result.open_ports.items():
+            # nmap lists hosts found inside a scoped range by address, and may
+            # report hosts the scope does not cover; only follow up in-scope ones
+            if host in planned or not is_within_scope(host, state.scope_trie):
+                continue
+            if 80 in ports or 443 in ports:
+                state.task_list.append(new_task(
+                    state, "gobuster", f"gobuster dir -u http://{host} -w common.txt", host
+                ))
+                planned.add(host)
     
     return state
 
-# Failure handling node
+# Continuation check
 def handle_failure(state: SecurityState) -> str:
-    """Handle task failures with retry logic."""
-    last_result = state.executed_tasks[-1] if state.executed_tasks else {}
-    
-    if last_result.get("status") == "failed" and state.retries < state.max_retries:
-        state.retries += 1
-        logger.info(f"Retrying task {state.current_task['command']} (Attempt {state.retries})")
+    """Loop back to execution while retried or newly queued tasks remain."""
+    if state.task_list:
         return "execute"
     return "continue"
 
@@ -209,14 +602,20 @@ workflow.add_conditional_edges(
 # Compile and run
 app = workflow.compile()
 
-def run_security_scan(instruction: str, scope: List[str]):
-    """Run the security workflow and generate audit report."""
+def run_security_workflow(instruction: str, scope: List[str]) -> SecurityState:
+    """Run the security workflow and return its final state."""
     initial_state = SecurityState(
-        task_list=[{"instruction": instruction}],
-        scope=scope
+        task_list=deque([{"instruction": instruction}]),
+        scope=scope,
+        scope_trie=build_scope_trie(scope)
     )
     
-    result = app.invoke(initial_state)
+    # The compiled graph returns the final channel values as a plain dict
+    return SecurityState(**asyncio.run(app.ainvoke(initial_state)))
+
+def run_security_scan(instruction: str, scope: List[str]) -> SecurityState:
+    """Run the security workflow and generate audit report."""
+    result = run_security_workflow(instruction, scope)
     generate_audit_reports(result)
     return result
 
@@ -0,0 +1,53 @@
+import os
+import stat
+import sys
+import textwrap
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    """Import main from a scratch directory so its logs stay out of the repo."""
+    os.chdir(tmp_path_factory.mktemp("run"))
+    sys.path.insert(0, REPO_ROOT)
+    import main
+    return main
+
+
+@pytest.fixture
+def stub_nmap(tmp_path, monkeypatch):
+    """Put an nmap on PATH that reports 192.168.1.5 and 10.0.0.9 with port 80 open."""
+    script = tmp_path / "nmap"
+    script.write_text(textwrap.dedent(f"""\
+        #!{sys.executable}
+        import sys
+        xml = sys.argv[sys.argv.index("-oX") + 1]
+        with open(xml, "w") as f:
+            f.write('<nmaprun>')
+            for addr in ("192.168.1.5", "10.0.0.9"):
+                f.write(f'<host><address addr="{{addr}}" addrtype="ipv4"/>'
+                        '<ports><port protocol="tcp" portid="80"><state state="open"/></port></ports></host>')
+            f.write('</nmaprun>')
+    """))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+
+def test_network_scope_matches_addresses_and_subnets(main):
+    trie = main.build_scope_trie(["192.168.1.0/24", "example.com"])
+    assert main.is_within_scope("192.168.1.5", trie)
+    assert main.is_within_scope("192.168.1.128/25", trie)
+    assert not main.is_within_scope("192.168.2.5", trie)
+    assert not main.is_within_scope("192.168.0.0/16", trie)
+    assert not main.is_within_scope("::1", trie)
+    assert main.is_within_scope("www.example.com", trie)
+
+
+def test_hosts_found_in_network_scope_are_not_violations(main, stub_nmap):
+    result = main.run_security_workflow("Scan for open ports", ["192.168.1.0/24"])
+    assert result.scope_violations == []
+    gobuster_targets = {t.target for t in result.executed_tasks if t.tool == "gobuster"}
+    assert gobuster_targets == {"192.168.1.5"}